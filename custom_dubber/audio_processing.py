@@ -13,6 +13,7 @@
 # limitations under the License.
 
 
+import math
 import os
 
 from typing import Final, Mapping, Sequence
@@ -24,11 +25,13 @@ from moviepy import AudioFileClip
 # from pyannote.audio import Pipeline
 
 import logging
+from .ffmpeg import FFmpeg
 from .pydub_audio_segment import AudioSegment
 
-_DEFAULT_DUBBED_VOCALS_AUDIO_FILE: Final[str] = "dubbed_vocals.mp3"
+_DEFAULT_DUBBED_VOCALS_AUDIO_FILE: Final[str] = "dubbed_vocals.wav"
 _DEFAULT_DUBBED_AUDIO_FILE: Final[str] = "dubbed_audio"
-_DEFAULT_OUTPUT_FORMAT: Final[str] = ".mp3"
+# AAC, so the final mux can copy the dubbed audio into the MP4 as is
+_DEFAULT_OUTPUT_FORMAT: Final[str] = ".m4a"
 
 
 def logger() -> logging.Logger:
@@ -160,7 +163,9 @@ def insert_audio_at_timestamps(
     dubbed_vocals_audio_file = os.path.join(
         output_directory, _DEFAULT_DUBBED_VOCALS_AUDIO_FILE
     )
-    output_audio.export(dubbed_vocals_audio_file, format="mp3")
+    # Kept as WAV since it's only an intermediate for merge_background_and_vocals,
+    # which does the single MP3 encode of the final mix
+    output_audio.export(dubbed_vocals_audio_file, format="wav")
     return dubbed_vocals_audio_file
 
 
@@ -200,6 +205,17 @@ def _needs_background_normalization(
         clip.close()
 
 
+def _normalization_gain(peak: float, headroom: float = 0.1) -> float:
+    """Returns the gain in dB that AudioSegment.normalize applies to a given peak.
+
+    Args:
+        peak: The peak amplitude, as a fraction of the maximum possible one.
+    """
+    if peak == 0:
+        return 0.0
+    return -headroom - 20 * math.log10(peak)
+
+
 def merge_background_and_vocals(
     *,
     background_audio_file: str,
@@ -208,16 +224,79 @@ def merge_background_and_vocals(
     target_language: str,
     vocals_volume_adjustment: float = 5.0,
     background_volume_adjustment: float = 0.0,
+    use_ffmpeg: bool = True,
 ) -> str:
     """Mixes background music and vocals tracks, normalizes the volume, and exports the result.
 
+    The mix is done in a single ffmpeg pass, applying the normalization and
+    volume adjustments as gains; use_ffmpeg=False mixes with pydub instead.
+
     Returns:
       The path to the output audio file with merged dubbed vocals and original
       background audio.
     """
+    target_language_suffix = "_" + target_language.replace("-", "_").lower()
+    dubbed_audio_file = os.path.join(
+        output_directory,
+        _DEFAULT_DUBBED_AUDIO_FILE + target_language_suffix + _DEFAULT_OUTPUT_FORMAT,
+    )
+    if not use_ffmpeg:
+        return _merge_background_and_vocals_pydub(
+            background_audio_file=background_audio_file,
+            dubbed_vocals_audio_file=dubbed_vocals_audio_file,
+            dubbed_audio_file=dubbed_audio_file,
+            vocals_volume_adjustment=vocals_volume_adjustment,
+            background_volume_adjustment=background_volume_adjustment,
+        )
+
+    background_gain = background_volume_adjustment
+    needs, max_amplitude = _needs_background_normalization(
+        background_audio_file=background_audio_file
+    )
+    if needs:
+        logger().info(
+            f"merge_background_and_vocals. Normalizing background (max amplitude {max_amplitude:.2f})"
+        )
+        background_gain += _normalization_gain(max_amplitude)
+
+    # The vocals are a WAV file, so reading their peak doesn't need a decode
+    vocals = AudioSegment.from_file(dubbed_vocals_audio_file)
+    vocals_gain = vocals_volume_adjustment + _normalization_gain(
+        vocals.max / vocals.max_possible_amplitude
+    )
 
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-y",
+        "-i",
+        background_audio_file,
+        "-i",
+        dubbed_vocals_audio_file,
+        "-filter_complex",
+        f"[0:a]volume={background_gain:.4f}dB[background];"
+        f"[1:a]volume={vocals_gain:.4f}dB[vocals];"
+        "[background][vocals]amix=inputs=2:duration=shortest:normalize=0",
+        "-c:a",
+        "aac",
+        "-b:a",
+        "192k",
+        dubbed_audio_file,
+    ]
+    FFmpeg()._run(command=cmd)
+    return dubbed_audio_file
+
+
+def _merge_background_and_vocals_pydub(
+    *,
+    background_audio_file: str,
+    dubbed_vocals_audio_file: str,
+    dubbed_audio_file: str,
+    vocals_volume_adjustment: float,
+    background_volume_adjustment: float,
+) -> str:
     background = AudioSegment.from_mp3(background_audio_file)
-    vocals = AudioSegment.from_mp3(dubbed_vocals_audio_file)
+    vocals = AudioSegment.from_file(dubbed_vocals_audio_file)
 
     # If background normalization is not needed, we skip it since it sometimes raises up
     # residuals vocals not properly split in the demucs processes
@@ -237,10 +316,5 @@ def merge_background_and_vocals(
     background = background[:shortest_length]
     vocals = vocals[:shortest_length]
     mixed_audio = background.overlay(vocals)
-    target_language_suffix = "_" + target_language.replace("-", "_").lower()
-    dubbed_audio_file = os.path.join(
-        output_directory,
-        _DEFAULT_DUBBED_AUDIO_FILE + target_language_suffix + _DEFAULT_OUTPUT_FORMAT,
-    )
-    mixed_audio.export(dubbed_audio_file, format="mp3")
+    mixed_audio.export(dubbed_audio_file, format="ipod", codec="aac", bitrate="192k")
     return dubbed_audio_file
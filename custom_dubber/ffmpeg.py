@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import os
 import shutil
 import subprocess
@@ -27,17 +28,26 @@ def logger() -> Logger:
 
 class FFmpeg:
     def _run(self, *, command: List[str], fail: bool = True):
-        with open(os.devnull, "wb") as devnull:
-            try:
-                result = subprocess.run(command, stdout=devnull, stderr=subprocess.PIPE)
-                if result.returncode != 0:
-                    raise subprocess.CalledProcessError(result.returncode, command)
-            except subprocess.CalledProcessError as e:
-                logger().error(
-                    f"Error running command: {command} failed with exit code {e.returncode} and output '{result.stderr}'"
-                )
-                if fail:
-                    raise
+        """Runs an ffmpeg command, keeping the tail of its stderr for error reports.
+
+        Raises:
+            subprocess.CalledProcessError: If the command fails and fail is set,
+                with the last lines it logged as stderr.
+        """
+        tail = collections.deque(maxlen=128)
+        with subprocess.Popen(
+            command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        ) as process:
+            # Draining stderr as it is written keeps the pipe from filling up
+            tail.extend(process.stderr)
+            returncode = process.wait()
+        if returncode:
+            stderr = b"".join(tail)
+            logger().error(
+                f"Error running command: {command} failed with exit code {returncode} and output '{stderr}'"
+            )
+            if fail:
+                raise subprocess.CalledProcessError(returncode, command, stderr=stderr)
 
     def convert_to_format(self, *, source: str, target: str):
         cmd = [
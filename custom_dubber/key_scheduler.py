@@ -0,0 +1,72 @@
+import random
+import threading
+import time
+
+
+class KeyScheduler:
+    """Hands out API keys to concurrent workers, least loaded key first.
+
+    A key is never used by more than per_key_parallelism requests at once, and a
+    key released after a failed request (usually a rate limit) is not handed out
+    again until its cooldown expires. The cooldown is the delay requested by the
+    server if known, otherwise it grows exponentially with the key's consecutive
+    failures, from initial_cooldown up to max_cooldown, plus up to a second of
+    jitter. acquire() blocks until a key is available.
+    """
+
+    def __init__(
+        self,
+        api_keys: list[str],
+        per_key_parallelism: int,
+        initial_cooldown: float = 2.0,
+        max_cooldown: float = 60.0,
+    ):
+        self._keys = {
+            key: {"in_flight": 0, "failures": 0, "cooldown_until": 0.0}
+            for key in api_keys
+        }
+        self._per_key_parallelism = per_key_parallelism
+        self._initial_cooldown = initial_cooldown
+        self._max_cooldown = max_cooldown
+        self._condition = threading.Condition()
+
+    def acquire(self) -> str:
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                available = [
+                    key
+                    for key, state in self._keys.items()
+                    if state["cooldown_until"] <= now
+                    and state["in_flight"] < self._per_key_parallelism
+                ]
+                if available:
+                    key = min(available, key=lambda k: self._keys[k]["in_flight"])
+                    self._keys[key]["in_flight"] += 1
+                    return key
+
+                # Wake up when the next cooldown ends, or on the next release
+                cooldowns = [
+                    state["cooldown_until"] - now
+                    for state in self._keys.values()
+                    if state["cooldown_until"] > now
+                ]
+                self._condition.wait(timeout=min(cooldowns) if cooldowns else None)
+
+    def release(self, key: str, ok: bool = True, retry_after: float | None = None):
+        with self._condition:
+            state = self._keys[key]
+            state["in_flight"] -= 1
+            if ok:
+                state["failures"] = 0
+            else:
+                state["failures"] += 1
+                if retry_after is None:
+                    retry_after = min(
+                        self._max_cooldown,
+                        self._initial_cooldown * 2 ** (state["failures"] - 1),
+                    ) + random.uniform(0, 1)
+                state["cooldown_until"] = max(
+                    state["cooldown_until"], time.monotonic() + retry_after
+                )
+            self._condition.notify_all()
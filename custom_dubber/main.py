@@ -1,22 +1,45 @@
 import argparse
 import os
 import shutil
-import json
+import orjson
 from pathlib import Path
 import concurrent.futures
-from itertools import cycle
 
 from custom_dubber.utils import (
+    atomic_write_bytes,
     extract_transcripts,
     translate_transcripts,
     concat_close_transcripts,
     transcribe_using_ytt,
+    fetch_ytt_transcript,
     yt_download,
-    synthesize_speech_worker,
+    batch_transcripts_for_tts,
+    synthesize_speech_batch_worker,
+    load_tts_progress,
+    append_tts_progress,
+    SEGMENTS_DIRECTORY,
 )
 from . import audio_processing
+from .key_scheduler import KeyScheduler
+from .text_to_speech_gemini import TextToSpeechGemini
+from .tts_cache import TTSCache
 from .video_processing import VideoProcessing
 
+_GITIGNORE_SRC = Path(__file__).resolve().parent.parent / ".gitignore.template"
+
+
+def _save_metadata(path: str, metadata: dict):
+    """Rewrites the metadata file atomically so a crash never leaves it truncated."""
+    atomic_write_bytes(path, orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+
+
+def _has_subtitles(output_directory, source_language, target_language):
+    """Returns whether subtitles from a previous download will be used."""
+    return any(
+        os.path.exists(os.path.join(output_directory, "subtitles", f"{lang}.json"))
+        for lang in (source_language, target_language)
+    )
+
 
 def main(
     youtube_id: str,
@@ -28,52 +51,74 @@ def main(
     name: str | None = None,
     move_directory: str | None = None,
     cleanup: bool = False,
+    tts_workers: int | None = None,
+    tts_batch_chars: int = 0,
+    tts_batch_segments: int = 4,
+    cache_ttl_days: float = 30,
+    pydub_mix: bool = False,
+    reencode: bool = False,
 ):
     # Create output directory if it doesn't exist
     os.makedirs(output_directory, exist_ok=True)
     # copy the ignore file to output directory
-
-    shutil.copyfile(
-        os.path.join(Path(__file__).parent.parent, ".gitignore.template"),
-        os.path.join(output_directory, ".gitignore"),
-    )
+    gitignore_file = os.path.join(output_directory, ".gitignore")
+    if not os.path.exists(gitignore_file):
+        shutil.copyfile(_GITIGNORE_SRC, gitignore_file)
 
     download_metadata_file = os.path.join(output_directory, "download_metadata.json")
     download_metadata = {}
 
     if os.path.exists(download_metadata_file):
-        with open(download_metadata_file, "r", encoding="utf-8") as f:
-            download_metadata = json.load(f)
+        with open(download_metadata_file, "rb") as f:
+            download_metadata = orjson.loads(f.read())
 
     video_path = download_metadata.get("video_path", "")
     audio_path = download_metadata.get("audio_path", "")
     subtitle_paths = download_metadata.get("subtitle_paths", [])
 
-    if not video_path or not audio_path:
-        print("Video or audio file not found, downloading...")
-        video_path, audio_path, subtitle_paths = yt_download(
-            youtube_id, output_directory, source_language, target_language
-        )
+    transcripts = download_metadata.get("transcripts", [])
+    ytt_future = None
 
-        with open(download_metadata_file, "w", encoding="utf-8") as f:
-            json.dump(
-                {
-                    "video_path": video_path,
-                    "audio_path": audio_path,
-                    "subtitle_paths": subtitle_paths,
-                },
-                f,
-                ensure_ascii=False,
-                indent=4,
+    if not video_path or not audio_path:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as ytt_executor:
+            # The YouTube transcript is only used when no subtitles are
+            # downloaded, but fetching it alongside the download hides its
+            # latency when it is needed
+            if not transcripts and not _has_subtitles(
+                output_directory, source_language, target_language
+            ):
+                ytt_future = ytt_executor.submit(
+                    fetch_ytt_transcript,
+                    youtube_id,
+                    source_language,
+                    target_language,
+                    output_directory,
+                )
+            print("Video or audio file not found, downloading...")
+            video_path, audio_path, subtitle_paths = yt_download(
+                youtube_id, output_directory, source_language, target_language
             )
 
-    transcripts = download_metadata.get("transcripts", [])
+        _save_metadata(
+            download_metadata_file,
+            {
+                "video_path": video_path,
+                "audio_path": audio_path,
+                "subtitle_paths": subtitle_paths,
+            },
+        )
+
     if not transcripts:
         # Fetch the transcript
         transcripts = []
         if len(subtitle_paths) == 0:
             transcripts = transcribe_using_ytt(
-                youtube_id, source_language, target_language, api_keys
+                youtube_id,
+                source_language,
+                target_language,
+                api_keys,
+                fetched=ytt_future.result() if ytt_future else None,
+                output_directory=output_directory,
             )
         elif len(subtitle_paths) == 1:
             source_subtitle_path = subtitle_paths[0]
@@ -87,10 +132,10 @@ def main(
             transcripts = extract_transcripts(target_subtitle_path)
             transcripts = [
                 {
-                    "start": item["start"],
-                    "end": item["end"],
-                    "text": item["text"],
-                    "translated_text": item["text"],
+                    "start": item.start,
+                    "end": item.end,
+                    "text": item.text,
+                    "translated_text": item.text,
                 }
                 for item in transcripts
             ]
@@ -102,53 +147,91 @@ def main(
         print(f"Total transcript segments: {len(transcripts)}")
         transcripts = concat_close_transcripts(transcripts, threshold=3.5)
         print(f"Total transcript segments after concatenation: {len(transcripts)}")
-        with open(download_metadata_file, "w", encoding="utf-8") as f:
-            json.dump(
-                {
-                    "video_path": video_path,
-                    "audio_path": audio_path,
-                    "subtitle_paths": subtitle_paths,
-                    "transcripts": transcripts,
-                },
-                f,
-                ensure_ascii=False,
-                indent=4,
-            )
+        _save_metadata(
+            download_metadata_file,
+            {
+                "video_path": video_path,
+                "audio_path": audio_path,
+                "subtitle_paths": subtitle_paths,
+                "transcripts": transcripts,
+            },
+        )
 
     if not download_metadata.get("tts_complete", False):
         print("Starting text-to-speech synthesis...")
+        TTSCache(output_directory).purge(max_age_days=cache_ttl_days)
+        os.makedirs(os.path.join(output_directory, SEGMENTS_DIRECTORY), exist_ok=True)
+        # Segments finished before an interruption are checkpointed one by one
+        progress_file = os.path.join(output_directory, "tts_progress.jsonl")
+        completed = load_tts_progress(progress_file, transcripts)
+        if completed:
+            print(f"Resuming, {len(completed)} segments already synthesized.")
         # Convert text to speech in parallel
-        updated_transcripts = []
-        api_key_cycle = cycle(api_keys)
+        updated_transcripts = [None] * len(transcripts)
+        for i, item in completed.items():
+            updated_transcripts[i] = item
+        if not tts_workers:
+            tts_workers = min(len(api_keys) * 4, 32)
+        # Limit in-flight requests per key so a single key doesn't burst past its quota
+        per_key_parallelism = max(1, -(-tts_workers // len(api_keys)))
+        scheduler = KeyScheduler(api_keys, per_key_parallelism)
+        # One client per key, so its connections are reused across segments
+        tts_clients = {key: TextToSpeechGemini(api_key=key) for key in api_keys}
         with concurrent.futures.ThreadPoolExecutor(
-            max_workers=1  # len(api_keys)
+            max_workers=tts_workers
         ) as executor:
-            futures = [
+            if tts_batch_chars:
+                batches = batch_transcripts_for_tts(
+                    transcripts,
+                    max_chars=tts_batch_chars,
+                    max_gap=20.0,
+                    max_items=tts_batch_segments,
+                )
+            else:
+                batches = [[i] for i in range(len(transcripts))]
+            batches = [[i for i in batch if i not in completed] for batch in batches]
+            batches = [batch for batch in batches if batch]
+            print(f"Total TTS requests: {len(batches)}")
+            futures = {
                 executor.submit(
-                    synthesize_speech_worker,
-                    item,
-                    i,
-                    len(transcripts),
+                    synthesize_speech_batch_worker,
+                    transcripts,
+                    batch,
                     output_directory,
                     voice,
                     target_language,
-                    next(api_key_cycle),
-                )
-                for i, item in enumerate(transcripts)
-            ]
+                    scheduler,
+                    tts_clients,
+                ): batch
+                for batch in batches
+            }
 
+            # Results are consumed on this thread only, so appends don't interleave
             for future in concurrent.futures.as_completed(futures):
                 try:
-                    updated_transcripts.append(future.result())
+                    items = future.result()
                 except Exception as e:
                     print(f"Error during TTS synthesis: {e}")
+                    continue
+                entries = [
+                    (i, item)
+                    for i, item in zip(futures[future], items)
+                    if item is not None
+                ]
+                append_tts_progress(progress_file, entries)
+                for i, item in entries:
+                    updated_transcripts[i] = item
 
-        # Sort transcripts back to original order based on start time
-        transcripts = sorted(updated_transcripts, key=lambda x: x["start"])
-        print("All segments processed.")
-
-        with open(download_metadata_file, "w", encoding="utf-8") as f:
-            json.dump(
+        # Segments that failed are left out
+        transcripts = [item for item in updated_transcripts if item is not None]
+        failed = len(updated_transcripts) - len(transcripts)
+        if failed:
+            # The progress file is kept, so the next run only retries these
+            print(f"{failed} segments failed, they will be retried on the next run.")
+        else:
+            print("All segments processed.")
+            _save_metadata(
+                download_metadata_file,
                 {
                     "video_path": video_path,
                     "audio_path": audio_path,
@@ -156,10 +239,9 @@ def main(
                     "transcripts": transcripts,
                     "tts_complete": True,
                 },
-                f,
-                ensure_ascii=False,
-                indent=4,
             )
+            if os.path.exists(progress_file):
+                os.remove(progress_file)
 
     print("Inserting dubbed vocals into background audio...")
 
@@ -176,6 +258,7 @@ def main(
         target_language=target_language,
         vocals_volume_adjustment=5.0,
         background_volume_adjustment=0.0,
+        use_ffmpeg=not pydub_mix,
     )
 
     print(f"Final dubbed audio saved to {dubbed_audio_file}")
@@ -184,6 +267,7 @@ def main(
         dubbed_audio_file=dubbed_audio_file,
         output_directory=output_directory,
         target_language=target_language,
+        reencode=reencode,
     )
     print(f"Dubbed video saved to {dubbed_video_file}")
 
@@ -203,10 +287,12 @@ def main(
 
     if cleanup:
         print("Cleaning up intermediate files...")
-        for item in transcripts:
-            dubbed_path = item.get("dubbed_path")
-            if dubbed_path and os.path.exists(dubbed_path):
-                os.remove(dubbed_path)
+        segments_directory = os.path.join(output_directory, SEGMENTS_DIRECTORY)
+        if os.path.isdir(segments_directory):
+            with os.scandir(segments_directory) as entries:
+                for entry in entries:
+                    os.unlink(entry.path)
+            os.rmdir(segments_directory)
         if os.path.exists(dubbed_audio_vocals_file):
             os.remove(dubbed_audio_vocals_file)
         print("Cleanup completed.")
@@ -247,6 +333,42 @@ if __name__ == "__main__":
         default=False,
         help="Cleanup intermediate files",
     )
+    parser.add_argument(
+        "--tts_workers",
+        type=int,
+        default=None,
+        help="Number of parallel text-to-speech workers (defaults to 4 per API key, up to 32)",
+    )
+    parser.add_argument(
+        "--tts_batch_chars",
+        type=int,
+        default=0,
+        help="Batch consecutive segments into TTS requests of up to this many characters (0 disables batching)",
+    )
+    parser.add_argument(
+        "--tts_batch_segments",
+        type=int,
+        default=4,
+        help="Maximum number of segments per batched TTS request",
+    )
+    parser.add_argument(
+        "--cache_ttl_days",
+        type=float,
+        default=30,
+        help="Delete cached text-to-speech audio older than this many days",
+    )
+    parser.add_argument(
+        "--pydub_mix",
+        action="store_true",
+        default=False,
+        help="Mix background and vocals with pydub instead of a single ffmpeg pass",
+    )
+    parser.add_argument(
+        "--reencode",
+        action="store_true",
+        default=False,
+        help="Re-encode the video stream instead of copying it into the dubbed video",
+    )
     args = parser.parse_args()
 
     main(
@@ -259,4 +381,10 @@ if __name__ == "__main__":
         name=args.name,
         move_directory=args.move_directory,
         cleanup=args.cleanup,
+        tts_workers=args.tts_workers,
+        tts_batch_chars=args.tts_batch_chars,
+        tts_batch_segments=args.tts_batch_segments,
+        cache_ttl_days=args.cache_ttl_days,
+        pydub_mix=args.pydub_mix,
+        reencode=args.reencode,
     )
@@ -12,45 +12,143 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import io
-from time import sleep
-from typing import List, NamedTuple
+import functools
+import os
+import re
+from typing import BinaryIO, NamedTuple
 import mimetypes
 import struct
-import hashlib
-import json
-from pathlib import Path
-import shutil
 
 from google import genai
 from google.genai import types, errors
-from pydub import AudioSegment
 from logging import Logger
-from .ffmpeg import FFmpeg
+import numpy as np
+
+
+_STYLE_PROMPT_TMPL = """
+<style-instruction>
+The following is a dub of a documentary in {target_language} language.
+Take pauses and intonate accordingly.
+Read aloud in a calm, soothing, enthusiastic tone like David Attenborough at a good pace:
+</style-instruction>
+{text}
+"""
 
 
 def logger() -> Logger:
     return Logger("text_to_speech_gemini")
 
 
+class NoAudioError(Exception):
+    """The TTS stream completed without returning any audio data."""
+
+
 class Voice(NamedTuple):
     name: str
     gender: str
     region: str = ""
 
 
-def _write_wav_to_mp3(wav_data: bytes, filename: str):
-    """Converts WAV audio data to MP3 format.
-
-    Args:
-        wav_data: The raw WAV audio data as a bytes object.
+# Genders are inferred from the names. This might not be 100% accurate.
+_VOICES = (
+    Voice(name="Zephyr", gender="Female"),
+    Voice(name="Puck", gender="Male"),
+    Voice(name="Charon", gender="Male"),
+    Voice(name="Kore", gender="Female"),
+    Voice(name="Fenrir", gender="Male"),
+    Voice(name="Leda", gender="Female"),
+    Voice(name="Orus", gender="Male"),
+    Voice(name="Aoede", gender="Female"),
+    Voice(name="Callirrhoe", gender="Female"),
+    Voice(name="Autonoe", gender="Female"),
+    Voice(name="Enceladus", gender="Male"),
+    Voice(name="Iapetus", gender="Male"),
+    Voice(name="Umbriel", gender="Male"),
+    Voice(name="Algieba", gender="Male"),
+    Voice(name="Despina", gender="Female"),
+    Voice(name="Erinome", gender="Female"),
+    Voice(name="Algenib", gender="Male"),
+    Voice(name="Rasalgethi", gender="Male"),
+    Voice(name="Laomedeia", gender="Female"),
+    Voice(name="Achernar", gender="Male"),
+    Voice(name="Alnilam", gender="Male"),
+    Voice(name="Schedar", gender="Male"),
+    Voice(name="Gacrux", gender="Male"),
+    Voice(name="Pulcherrima", gender="Female"),
+    Voice(name="Achird", gender="Male"),
+    Voice(name="Zubenelgenubi", gender="Male"),
+    Voice(name="Vindemiatrix", gender="Female"),
+    Voice(name="Sadachbia", gender="Female"),
+    Voice(name="Sadaltager", gender="Male"),
+    Voice(name="Sulafat", gender="Female"),
+)
+
+_LANGUAGES = tuple(
+    sorted(
+        [
+            "afr",
+            "ara",
+            "hye",
+            "aze",
+            "bel",
+            "bos",
+            "bul",
+            "cat",
+            "zho",
+            "hrv",
+            "ces",
+            "dan",
+            "nld",
+            "eng",
+            "est",
+            "fin",
+            "fra",
+            "glg",
+            "deu",
+            "ell",
+            "heb",
+            "hin",
+            "hun",
+            "isl",
+            "ind",
+            "ita",
+            "jpn",
+            "kan",
+            "kaz",
+            "kor",
+            "lav",
+            "lit",
+            "mkd",
+            "msa",
+            "mar",
+            "mri",
+            "nep",
+            "nor",
+            "fas",
+            "pol",
+            "por",
+            "ron",
+            "rus",
+            "srp",
+            "slk",
+            "slv",
+            "spa",
+            "swa",
+            "swe",
+            "tgl",
+            "tam",
+            "tha",
+            "tur",
+            "ukr",
+            "urd",
+            "vie",
+            "cym",
+        ]
+    )
+)
 
-    Returns:
-        None
-    """
 
-    audio_segment = AudioSegment.from_file(io.BytesIO(wav_data), format="wav")
-    audio_segment.export(filename, format="mp3")
+_WAV_HDR = struct.Struct("<4sI4s4sIHHIIHH4sI")
 
 
 def _convert_to_wav(audio_data: bytes, mime_type: str) -> bytes:
@@ -63,9 +161,7 @@ def _convert_to_wav(audio_data: bytes, mime_type: str) -> bytes:
     Returns:
         A bytes object representing the WAV file header.
     """
-    parameters = _parse_audio_mime_type(mime_type)
-    bits_per_sample = parameters["bits_per_sample"]
-    sample_rate = parameters["rate"]
+    bits_per_sample, sample_rate = _parse_audio_mime_type(mime_type)
     num_channels = 1
     data_size = len(audio_data)
     bytes_per_sample = bits_per_sample // 8
@@ -75,8 +171,10 @@ def _convert_to_wav(audio_data: bytes, mime_type: str) -> bytes:
 
     # http://soundfile.sapp.org/doc/WaveFormat/
 
-    header = struct.pack(
-        "<4sI4s4sIHHIIHH4sI",
+    wav = bytearray(_WAV_HDR.size + data_size)
+    _WAV_HDR.pack_into(
+        wav,
+        0,
         b"RIFF",  # ChunkID
         chunk_size,  # ChunkSize (total file size - 8 bytes)
         b"WAVE",  # Format
@@ -91,10 +189,83 @@ def _convert_to_wav(audio_data: bytes, mime_type: str) -> bytes:
         b"data",  # Subchunk2ID
         data_size,  # Subchunk2Size (size of audio data)
     )
-    return header + audio_data
+    wav[_WAV_HDR.size :] = audio_data
+    return bytes(wav)
+
+
+@functools.lru_cache(maxsize=32)
+def _wav_header(mime_type: str) -> bytes:
+    """Returns the WAV header for a stream of the given mime type.
+
+    The size fields are zero, to be filled in by _patch_wav_sizes once the
+    stream is written.
+    """
+    return _convert_to_wav(b"", mime_type)
+
+
+def _patch_wav_sizes(f: BinaryIO) -> None:
+    """Fills in the size fields of a WAV header written before its audio data.
+
+    Args:
+        f: The WAV file, opened for writing and positioned at its end.
+    """
+    data_size = f.tell() - _WAV_HDR.size
+    f.seek(4)
+    f.write(struct.pack("<I", _WAV_HDR.size - 8 + data_size))  # ChunkSize
+    f.seek(_WAV_HDR.size - 4)
+    f.write(struct.pack("<I", data_size))  # Subchunk2Size
+    f.seek(0, os.SEEK_END)
 
 
-def _parse_audio_mime_type(mime_type: str) -> dict[str, int | None]:
+_BITS_PER_SAMPLE_RE = re.compile(r"audio/L(\d+)")
+_RATE_RE = re.compile(r"rate=(\d+)", re.IGNORECASE)
+
+
+def _truncate_end_silence(
+    path: str, silence_threshold: float = -50.0, chunk_ms: int = 10
+) -> None:
+    """Truncates the trailing silence of a WAV file with a plain 44-byte header.
+
+    Like pydub's detect_leading_silence on the reversed audio, the file is
+    scanned from the end in chunk_ms chunks until one is at least
+    silence_threshold dBFS. Only the silent tail is read, and the file is cut
+    in place, so it must not be linked elsewhere yet.
+
+    Args:
+        path: The WAV file, as written by _convert_text_to_speech.
+        silence_threshold: RMS level in dBFS under which a chunk is silent.
+        chunk_ms: Length of the chunks the audio is scanned in.
+    """
+    with open(path, "r+b") as f:
+        header = _WAV_HDR.unpack(f.read(_WAV_HDR.size))
+        sample_rate, block_align, bits_per_sample = header[7], header[9], header[10]
+        data_end = _WAV_HDR.size + header[12]
+        chunk_size = sample_rate * chunk_ms // 1000 * block_align
+        threshold = 10 ** (silence_threshold / 20) * 2 ** (bits_per_sample - 1)
+
+        end = data_end
+        while end - _WAV_HDR.size >= chunk_size:
+            # Read up to a second at a time, in whole chunks counted from the end
+            chunks = min((end - _WAV_HDR.size) // chunk_size, 1000 // chunk_ms)
+            f.seek(end - chunks * chunk_size)
+            samples = np.frombuffer(
+                f.read(chunks * chunk_size), dtype=f"<i{bits_per_sample // 8}"
+            ).reshape(chunks, -1)[::-1]
+            rms = np.sqrt(np.mean(samples.astype(np.float64) ** 2, axis=1))
+            loud = np.flatnonzero(rms >= threshold)
+            if loud.size:
+                end -= int(loud[0]) * chunk_size
+                break
+            end -= chunks * chunk_size
+
+        if end < data_end:
+            f.truncate(end)
+            f.seek(0, os.SEEK_END)
+            _patch_wav_sizes(f)
+
+
+@functools.lru_cache(maxsize=32)
+def _parse_audio_mime_type(mime_type: str) -> tuple[int, int]:
     """Parses bits per sample and rate from an audio MIME type string.
 
     Assumes bits per sample is encoded like "L16" and rate as "rate=xxxxx".
@@ -103,35 +274,20 @@ def _parse_audio_mime_type(mime_type: str) -> dict[str, int | None]:
         mime_type: The audio MIME type string (e.g., "audio/L16;rate=24000").
 
     Returns:
-        A dictionary with "bits_per_sample" and "rate" keys. Values will be
-        integers if found, otherwise None.
+        A (bits_per_sample, rate) tuple, defaulting to 16 bits and 24000 Hz
+        for values that are not found.
     """
-    bits_per_sample = 16
-    rate = 24000
-
-    # Extract rate from parameters
-    parts = mime_type.split(";")
-    for param in parts:  # Skip the main type part
-        param = param.strip()
-        if param.lower().startswith("rate="):
-            try:
-                rate_str = param.split("=", 1)[1]
-                rate = int(rate_str)
-            except (ValueError, IndexError):
-                # Handle cases like "rate=" with no value or non-integer value
-                pass  # Keep rate as default
-        elif param.startswith("audio/L"):
-            try:
-                bits_per_sample = int(param.split("L", 1)[1])
-            except (ValueError, IndexError):
-                pass  # Keep bits_per_sample as default if conversion fails
-
-    return {"bits_per_sample": bits_per_sample, "rate": rate}
+    bits_per_sample = _BITS_PER_SAMPLE_RE.search(mime_type)
+    rate = _RATE_RE.search(mime_type)
+    return (
+        int(bits_per_sample.group(1)) if bits_per_sample else 16,
+        int(rate.group(1)) if rate else 24000,
+    )
 
 
 # Documentation: https://ai.google.dev/docs/gemini_api_overview
 class TextToSpeechGemini:
-    def __init__(self, device="cpu", server="", api_key="", cache_dir=".tts_cache"):
+    def __init__(self, device="cpu", server="", api_key=""):
         self._SSML_MALE: str = "Male"
         self._SSML_FEMALE: str = "Female"
         self._DEFAULT_SPEED: float = 1.0
@@ -141,8 +297,27 @@ class TextToSpeechGemini:
         self.api_key = api_key
         self.model = "gemini-2.5-flash-preview-tts"
         self.backup_model = "gemini-2.5-pro-preview-tts"
-        self.cache_dir = Path(cache_dir)
-        self.cache_dir.mkdir(exist_ok=True)
+        self._generate_content_configs: dict[str, types.GenerateContentConfig] = {}
+
+    def _generate_content_config(self, voice: str) -> types.GenerateContentConfig:
+        """Returns the request config for a voice, built once per voice."""
+        config = self._generate_content_configs.get(voice)
+        if config is None:
+            config = types.GenerateContentConfig(
+                temperature=1,
+                response_modalities=[
+                    "audio",
+                ],
+                speech_config=types.SpeechConfig(
+                    voice_config=types.VoiceConfig(
+                        prebuilt_voice_config=types.PrebuiltVoiceConfig(
+                            voice_name=voice
+                        )
+                    )
+                ),
+            )
+            self._generate_content_configs[voice] = config
+        return config
 
     def set_api_key(self, api_key: str):
         self.client = genai.Client(
@@ -150,127 +325,18 @@ class TextToSpeechGemini:
         )
         self.api_key = api_key
 
-    def get_available_voices(self, language_code: str) -> List[Voice]:
-        # Genders are inferred from the names. This might not be 100% accurate.
-        voice_data = {
-            "Zephyr": self._SSML_FEMALE,
-            "Puck": self._SSML_MALE,
-            "Charon": self._SSML_MALE,
-            "Kore": self._SSML_FEMALE,
-            "Fenrir": self._SSML_MALE,
-            "Leda": self._SSML_FEMALE,
-            "Orus": self._SSML_MALE,
-            "Aoede": self._SSML_FEMALE,
-            "Callirrhoe": self._SSML_FEMALE,
-            "Autonoe": self._SSML_FEMALE,
-            "Enceladus": self._SSML_MALE,
-            "Iapetus": self._SSML_MALE,
-            "Umbriel": self._SSML_MALE,
-            "Algieba": self._SSML_MALE,
-            "Despina": self._SSML_FEMALE,
-            "Erinome": self._SSML_FEMALE,
-            "Algenib": self._SSML_MALE,
-            "Rasalgethi": self._SSML_MALE,
-            "Laomedeia": self._SSML_FEMALE,
-            "Achernar": self._SSML_MALE,
-            "Alnilam": self._SSML_MALE,
-            "Schedar": self._SSML_MALE,
-            "Gacrux": self._SSML_MALE,
-            "Pulcherrima": self._SSML_FEMALE,
-            "Achird": self._SSML_MALE,
-            "Zubenelgenubi": self._SSML_MALE,
-            "Vindemiatrix": self._SSML_FEMALE,
-            "Sadachbia": self._SSML_FEMALE,
-            "Sadaltager": self._SSML_MALE,
-            "Sulafat": self._SSML_FEMALE,
-        }
-
-        voices = [
-            Voice(name=name, gender=gender, region="")
-            for name, gender in voice_data.items()
-        ]
-
-        logger().info(
-            f"text_to_speech_gemini.get_available_voices: {voices} for language {language_code}"
-        )
-
-        return voices
+    def get_available_voices(self, language_code: str) -> tuple[Voice, ...]:
+        return _VOICES
 
     def _does_voice_supports_speeds(self):
         # Gemini API does not seem to support speed control in the provided example
         return False
 
-    def _convert_text_to_speech_without_end_silence(
-        self,
-        *,
-        assigned_voice: str,
-        target_language: str,
-        output_filename: str,
-        text: str,
-        speed: float,
-    ) -> str:
-        """TTS add silence at the end that we want to remove to prevent increasing the speech of next
-        segments if is not necessary."""
-
-        dubbed_file = self._convert_text_to_speech(
-            assigned_voice=assigned_voice,
-            target_language=target_language,
-            output_filename=output_filename,
-            text=text,
-            speed=speed,
-        )
-
-        dubbed_audio = AudioSegment.from_file(dubbed_file)
-        pre_duration = len(dubbed_audio)
-
-        FFmpeg().remove_silence(filename=dubbed_file)
-        dubbed_audio = AudioSegment.from_file(dubbed_file)
-        post_duration = len(dubbed_audio)
-        if pre_duration != post_duration:
-            logger().debug(
-                f"text_to_speech._convert_text_to_speech_without_end_silence. File {dubbed_file} shorten from {pre_duration} to {post_duration}"
-            )
-
+    def _remove_end_silence(self, dubbed_file: str) -> str:
+        """Removes the silence TTS adds at the end of an already synthesized file."""
+        _truncate_end_silence(dubbed_file)
         return dubbed_file
 
-    def _get_cache_key(
-        self,
-        *,
-        assigned_voice: str,
-        target_language: str,
-        text: str,
-        speed: float,
-        backup: bool = False,
-    ) -> str:
-        """Generate a unique cache key based on input parameters."""
-        cache_data = {
-            "assigned_voice": assigned_voice,
-            "target_language": target_language,
-            "text": text,
-            "speed": speed,
-            "backup": backup,
-            "model": self.backup_model if backup else self.model,
-        }
-        cache_string = json.dumps(cache_data, sort_keys=True)
-        return hashlib.sha256(cache_string.encode()).hexdigest()
-
-    def _get_cached_audio(self, cache_key: str) -> str | None:
-        """Retrieve cached audio file if it exists."""
-        cache_file = self.cache_dir / f"{cache_key}.wav"
-        if cache_file.exists():
-            logger().debug(f"Cache hit for key: {cache_key}")
-            return str(cache_file)
-        return None
-
-    def _save_to_cache(self, cache_key: str, audio_file: str) -> None:
-        """Save audio file to cache."""
-        cache_file = self.cache_dir / f"{cache_key}.wav"
-        try:
-            shutil.copy2(audio_file, cache_file)
-            logger().debug(f"Saved to cache: {cache_key}")
-        except Exception as e:
-            logger().warning(f"Failed to save to cache: {e}")
-
     def _convert_text_to_speech(
         self,
         *,
@@ -285,186 +351,82 @@ class TextToSpeechGemini:
             f"text_to_speech_gemini._convert_text_to_speech: assigned_voice: {assigned_voice}, output_filename: '{output_filename}'"
         )
 
-        # Check cache first
-        # cache_key = self._get_cache_key(
-        #     assigned_voice=assigned_voice,
-        #     target_language=target_language,
-        #     text=text,
-        #     speed=speed,
-        #     backup=backup,
-        # )
-
-        # cached_file = self._get_cached_audio(cache_key)
-        # if cached_file:
-        #     # Copy cached file to output location
-        #     try:
-        #         shutil.copy2(cached_file, output_filename)
-        #         logger().info(f"Using cached audio for: {output_filename}")
-        #         return output_filename
-        #     except Exception as e:
-        #         logger().warning(
-        #             f"Failed to copy cached file: {e}, generating new audio"
-        #         )
-
         contents = [
-            types.Content(
-                role="user",
-                parts=[
-                    types.Part.from_text(
-                        text=f"""
-                        <style-instruction>
-                        The following is a dub of a documentary in {target_language} language. 
-                        Take pauses and intonate accordingly. 
-                        Read aloud in a calm, soothing, enthusiastic tone like David Attenborough at a good pace:
-                        </style-instruction>
-                        {text}
-                    """
-                    ),
+            {
+                "role": "user",
+                "parts": [
+                    {
+                        "text": _STYLE_PROMPT_TMPL.format(
+                            target_language=target_language, text=text
+                        )
+                    }
                 ],
-            ),
+            }
         ]
-        generate_content_config = types.GenerateContentConfig(
-            temperature=1,
-            response_modalities=[
-                "audio",
-            ],
-            speech_config=types.SpeechConfig(
-                voice_config=types.VoiceConfig(
-                    prebuilt_voice_config=types.PrebuiltVoiceConfig(
-                        voice_name=assigned_voice
-                    )
-                )
-            ),
-        )
+        generate_content_config = self._generate_content_config(assigned_voice)
 
-        full_audio_data = bytearray()
+        # Chunks are written as they arrive; the file only replaces
+        # output_filename once the stream completes, so a failed request
+        # never leaves a truncated segment behind.
+        partial_filename = output_filename + ".part"
         try:
-            for chunk in self.client.models.generate_content_stream(
-                model=self.model if not backup else self.backup_model,
-                contents=contents,
-                config=generate_content_config,
-            ):
-                if (
-                    chunk.candidates is None
-                    or chunk.candidates[0].content is None
-                    or chunk.candidates[0].content.parts is None
+            with open(partial_filename, "wb", buffering=1 << 20) as f:
+                needs_wav_header = None
+                wrote_audio = False
+                for chunk in self.client.models.generate_content_stream(
+                    model=self.model if not backup else self.backup_model,
+                    contents=contents,
+                    config=generate_content_config,
                 ):
-                    continue
-                if (
-                    chunk.candidates[0].content.parts[0].inline_data
-                    and chunk.candidates[0].content.parts[0].inline_data.data
-                ):
-                    inline_data = chunk.candidates[0].content.parts[0].inline_data
-                    data_buffer = inline_data.data
-                    file_extension = mimetypes.guess_extension(inline_data.mime_type)
-
-                    if file_extension is None or file_extension != ".wav":
-                        data_buffer = _convert_to_wav(
-                            inline_data.data, inline_data.mime_type
-                        )
-                    full_audio_data.extend(data_buffer)
-            try:
-                with open(output_filename, "wb") as f:
-                    f.write(bytes(full_audio_data))
-
-                # Save to cache
-                # self._save_to_cache(cache_key, output_filename)
-
-                return output_filename
-
-            except Exception as e:
-                logger().error(
-                    f"text_to_speech_gemini: Error writing audio file {output_filename}: {e}"
-                )
-                sleep(60)
-                return self._convert_text_to_speech(
-                    assigned_voice=assigned_voice,
-                    target_language=target_language,
-                    output_filename=output_filename,
-                    text=text,
-                    speed=speed,
-                    backup=False,
-                )
+                    if (
+                        chunk.candidates is None
+                        or chunk.candidates[0].content is None
+                        or chunk.candidates[0].content.parts is None
+                    ):
+                        continue
+                    if (
+                        chunk.candidates[0].content.parts[0].inline_data
+                        and chunk.candidates[0].content.parts[0].inline_data.data
+                    ):
+                        inline_data = chunk.candidates[0].content.parts[0].inline_data
+                        if needs_wav_header is None:
+                            # The mime type is the same for every chunk of a stream
+                            file_extension = mimetypes.guess_extension(
+                                inline_data.mime_type
+                            )
+                            needs_wav_header = (
+                                file_extension is None or file_extension != ".wav"
+                            )
+                            if needs_wav_header:
+                                f.write(_wav_header(inline_data.mime_type))
+                        f.write(inline_data.data)
+                        wrote_audio = True
+                if not wrote_audio:
+                    # An empty segment would later be taken as already synthesized
+                    raise NoAudioError(f"No audio data returned for {output_filename}")
+                if needs_wav_header:
+                    _patch_wav_sizes(f)
+            os.replace(partial_filename, output_filename)
+
+            return output_filename
 
         except errors.ClientError as e:
+            # Retrying is left to the caller, which can move to another key
             logger().error(
-                f"text_to_speech_gemini: Client error occurred: {e.message} (code: {e.code} - key {self.api_key}). Retrying after 60 seconds."
+                f"text_to_speech_gemini: Client error occurred: {e.message} (code: {e.code} - key {self.api_key})."
             )
-            sleep(60)
-            return self._convert_text_to_speech(
-                assigned_voice=assigned_voice,
-                target_language=target_language,
-                output_filename=output_filename,
-                text=text,
-                speed=speed,
-                backup=False,
+            raise
+        except OSError as e:
+            logger().error(
+                f"text_to_speech_gemini: Error writing audio file {output_filename}: {e}"
             )
+            raise
         except Exception as e:
             logger().error(f"text_to_speech_gemini: An error occurred: {e}")
             raise
+        finally:
+            if os.path.exists(partial_filename):
+                os.remove(partial_filename)
 
-    def get_languages(self):
-        languages = [
-            "afr",
-            "ara",
-            "hye",
-            "aze",
-            "bel",
-            "bos",
-            "bul",
-            "cat",
-            "zho",
-            "hrv",
-            "ces",
-            "dan",
-            "nld",
-            "eng",
-            "est",
-            "fin",
-            "fra",
-            "glg",
-            "deu",
-            "ell",
-            "heb",
-            "hin",
-            "hun",
-            "isl",
-            "ind",
-            "ita",
-            "jpn",
-            "kan",
-            "kaz",
-            "kor",
-            "lav",
-            "lit",
-            "mkd",
-            "msa",
-            "mar",
-            "mri",
-            "nep",
-            "nor",
-            "fas",
-            "pol",
-            "por",
-            "ron",
-            "rus",
-            "srp",
-            "slk",
-            "slv",
-            "spa",
-            "swa",
-            "swe",
-            "tgl",
-            "tam",
-            "tha",
-            "tur",
-            "ukr",
-            "urd",
-            "vie",
-            "cym",
-        ]
-
-        languages = sorted(list(languages))
-
-        logger().debug(f"text_to_speech_gemini.get_languages: {languages}")
-        return languages
+    def get_languages(self) -> tuple[str, ...]:
+        return _LANGUAGES
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from itertools import batched
 from time import sleep
 from google import genai
 from google.genai import types, errors
@@ -20,6 +21,72 @@ from logging import Logger
 _BREAK_MARKER = "<break>"
 STEPS = 20
 
+_LANGUAGES = (
+    "afr",
+    "ara",
+    "hye",
+    "aze",
+    "bel",
+    "bos",
+    "bul",
+    "cat",
+    "zho",
+    "hrv",
+    "ces",
+    "dan",
+    "nld",
+    "eng",
+    "est",
+    "fin",
+    "fra",
+    "glg",
+    "deu",
+    "ell",
+    "heb",
+    "hin",
+    "hun",
+    "isl",
+    "ind",
+    "ita",
+    "jpn",
+    "kan",
+    "kaz",
+    "kor",
+    "lav",
+    "lit",
+    "mkd",
+    "msa",
+    "mar",
+    "mri",
+    "nep",
+    "nor",
+    "fas",
+    "pol",
+    "por",
+    "ron",
+    "rus",
+    "srp",
+    "slk",
+    "slv",
+    "spa",
+    "swa",
+    "swe",
+    "tgl",
+    "tam",
+    "tha",
+    "tur",
+    "ukr",
+    "urd",
+    "vie",
+    "cym",
+)
+_LANGUAGE_PAIRS = frozenset(
+    (source, target)
+    for source in _LANGUAGES
+    for target in _LANGUAGES
+    if source != target
+)
+
 
 def logger() -> Logger:
     return Logger("translation_gemini")
@@ -30,6 +97,9 @@ class TranslationGemini:
         super().__init__()
         self.client = genai.Client(api_key=api_key)
         self.model = "gemini-2.0-flash"
+        self.generate_content_config = types.GenerateContentConfig(
+            temperature=0.5,
+        )
 
     def load_model(self):
         pass
@@ -46,15 +116,11 @@ class TranslationGemini:
                 ],
             ),
         ]
-        generate_content_config = types.GenerateContentConfig(
-            temperature=0.5,
-        )
-
         try:
             response_chunks = self.client.models.generate_content_stream(
                 model=model or self.model,
                 contents=contents,
-                config=generate_content_config,
+                config=self.generate_content_config,
             )
             translated_text = "".join(chunk.text for chunk in response_chunks)
             logger().info(
@@ -90,76 +156,8 @@ class TranslationGemini:
             logger().error(f"translation_gemini: An error occurred: {e}")
             raise
 
-    def get_language_pairs(self):
-        languages = [
-            "afr",
-            "ara",
-            "hye",
-            "aze",
-            "bel",
-            "bos",
-            "bul",
-            "cat",
-            "zho",
-            "hrv",
-            "ces",
-            "dan",
-            "nld",
-            "eng",
-            "est",
-            "fin",
-            "fra",
-            "glg",
-            "deu",
-            "ell",
-            "heb",
-            "hin",
-            "hun",
-            "isl",
-            "ind",
-            "ita",
-            "jpn",
-            "kan",
-            "kaz",
-            "kor",
-            "lav",
-            "lit",
-            "mkd",
-            "msa",
-            "mar",
-            "mri",
-            "nep",
-            "nor",
-            "fas",
-            "pol",
-            "por",
-            "ron",
-            "rus",
-            "srp",
-            "slk",
-            "slv",
-            "spa",
-            "swa",
-            "swe",
-            "tgl",
-            "tam",
-            "tha",
-            "tur",
-            "ukr",
-            "urd",
-            "vie",
-            "cym",
-        ]
-        results = set()
-        for source in languages:
-            for target in languages:
-                if source != target:
-                    results.add((source, target))
-        logger().info(
-            "translation_gemini: The Gemini API supports many language pairs. "
-            f"Returning {len(results)} language pairs."
-        )
-        return results
+    def get_language_pairs(self) -> frozenset[tuple[str, str]]:
+        return _LANGUAGE_PAIRS
 
     def _translate_script(
         self,
@@ -174,11 +172,12 @@ class TranslationGemini:
         parts = script.split(_BREAK_MARKER)
         script_splits = []
 
-        for i in range(0, len(parts), STEPS):
+        total = (len(parts) + STEPS - 1) // STEPS
+        for i, batch in enumerate(batched(parts, STEPS)):
             logger().warning(
-                f"translation_gemini: Translating script part {i//STEPS + 1} / {(len(parts) + STEPS - 1)//STEPS}"
+                f"translation_gemini: Translating script part {i + 1} / {total}"
             )
-            part = _BREAK_MARKER.join(parts[i : i + STEPS])
+            part = _BREAK_MARKER.join(batch)
 
             translated_script = self._translate_text(
                 source_language=source_language,
@@ -0,0 +1,89 @@
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from logging import Logger
+
+_CACHE_DIRECTORY = ".tts_cache"
+
+
+def logger() -> Logger:
+    return Logger("tts_cache")
+
+
+def _link(source: str, target: str):
+    """Hard links source to target, replacing target, or copies it across devices."""
+    # A private temporary directory keeps concurrent links to the same target
+    # from writing through each other's files
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(target) or ".") as tmp_dir:
+        tmp_target = os.path.join(tmp_dir, os.path.basename(target))
+        try:
+            os.link(source, tmp_target)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.copy2(source, tmp_target)
+        os.replace(tmp_target, target)
+
+
+class TTSCache:
+    """Content-addressed cache of synthesized segments.
+
+    Entries are stored under output_directory/.tts_cache/<key[:2]>/<key>.wav and
+    shared with the segment files through hard links, so both must be treated as
+    read-only once cached.
+    """
+
+    def __init__(self, output_directory: str):
+        self.cache_dir = os.path.join(output_directory, _CACHE_DIRECTORY)
+
+    @staticmethod
+    def key(*, voice: str, target_language: str, speed: float, text: str) -> str:
+        # Fields are NUL-separated and the text goes last, so no two field
+        # combinations hash the same bytes
+        h = hashlib.blake2b(digest_size=32)
+        for field in (voice, target_language, str(speed)):
+            h.update(field.encode())
+            h.update(b"\0")
+        h.update(text.encode())
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.wav")
+
+    def get(self, key: str) -> str | None:
+        path = self._path(key)
+        return path if os.path.exists(path) else None
+
+    def put(self, key: str, path: str):
+        cache_file = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            _link(path, cache_file)
+        except OSError as e:
+            logger().warning(f"tts_cache: Failed to cache {path}: {e}")
+
+    def restore(self, key: str, path: str) -> bool:
+        """Places the cached audio for key at path, returning whether it was cached."""
+        cache_file = self.get(key)
+        if cache_file is None:
+            return False
+        _link(cache_file, path)
+        return True
+
+    def purge(self, *, max_age_days: float):
+        """Deletes the entries created more than max_age_days ago."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        oldest = time.time() - max_age_days * 24 * 60 * 60
+        for directory, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    if os.stat(path).st_mtime < oldest:
+                        os.remove(path)
+                except FileNotFoundError:
+                    # Temporary file of a link in progress
+                    continue
@@ -1,63 +1,88 @@
-import json5
+import concurrent.futures
+import orjson
 import random
-import re
 import os
+import tempfile
+import wave
+import numpy as np
+from google.genai import errors
+from .text_to_speech_gemini import NoAudioError
 from .translation_gemini import TranslationGemini
 from .video_downloader import VideoDownloader
-from .youtube_to_text import YoutubeToText
-from .text_to_speech_gemini import TextToSpeechGemini
+from .youtube_to_text import _BRACKET_RE, Cue, YoutubeToText
+from .tts_cache import TTSCache
 
 _BREAK_MARKER = "<break>"
+_PAUSE_TMPL = "\n (pause for {seconds} seconds). \n"
+_TTS_BATCH_PAUSE = _PAUSE_TMPL.format(seconds=2)
+SEGMENTS_DIRECTORY = "segments"
+_MAX_TTS_ATTEMPTS = 6
+
+
+def atomic_write_bytes(path, data):
+    """Writes data to path through a temporary file in the same directory.
+
+    The file only replaces path once it is complete, so a crash never leaves a
+    truncated file behind, and concurrent writers never share a temporary file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 
 def extract_transcripts(subtitle_path):
     def filter_bracket_text(text):
         # Remove text within square brackets and parentheses
-        text = re.sub(r"\[.*?\]", "", text)
-        text = re.sub(r"\(.*?\)", "", text)
-        return text.strip()
+        if "[" not in text and "(" not in text:
+            return text.strip()
+        return _BRACKET_RE.sub("", text).strip()
 
     transcripts = []
-    with open(subtitle_path, "r", encoding="utf-8") as f:
-        subtitle_data = json5.load(f)
-        for item in subtitle_data["events"]:
-            if "segs" in item:
-                text = "".join([seg["utf8"] for seg in item["segs"]])
-
-                if filter_bracket_text(text) == "":
-                    continue
-
-                transcripts.append(
-                    {
-                        "start": item["tStartMs"] / 1000.0,
-                        "end": (item["tStartMs"] + item["dDurationMs"]) / 1000.0,
-                        "text": text,
-                    }
+    with open(subtitle_path, "rb") as f:
+        subtitle_data = orjson.loads(f.read())
+    for item in subtitle_data["events"]:
+        if "segs" in item:
+            text = "".join(seg["utf8"] for seg in item["segs"])
+
+            if filter_bracket_text(text) == "":
+                continue
+
+            transcripts.append(
+                Cue(
+                    start=item["tStartMs"] / 1000.0,
+                    end=(item["tStartMs"] + item["dDurationMs"]) / 1000.0,
+                    text=text,
                 )
+            )
     return transcripts
 
 
 def translate_transcripts(transcripts, source_language, target_language, api_keys):
     results = []
 
-    all_texts = _BREAK_MARKER.join([item["text"] + "\n" for item in transcripts])
+    all_texts = ("\n" + _BREAK_MARKER).join(item.text for item in transcripts) + "\n"
     translator = TranslationGemini(api_key=random.choice(api_keys))
     translated_text = translator._translate_script(
         script=all_texts,
         source_language=source_language,
         target_language=target_language,
     )
-    print("Translated text:")
     translated_texts = translated_text.split(_BREAK_MARKER)
     assert len(translated_texts) == len(transcripts)
-    print("Building transcripts with translated text...", translated_texts)
-    for i in range(len(transcripts)):
+    print("Building transcripts with translated text...")
+    for item, translated in zip(transcripts, translated_texts):
         results.append(
             {
-                "start": transcripts[i]["start"],
-                "end": transcripts[i]["end"],
-                "text": transcripts[i]["text"],
-                "translated_text": translated_texts[i].strip(),
+                "start": item.start,
+                "end": item.end,
+                "text": item.text,
+                "translated_text": translated.strip(),
             }
         )
     return results
@@ -67,7 +92,8 @@ def concat_close_transcripts(transcripts, threshold=2.0):
     if not transcripts:
         return []
 
-    concatenated = [transcripts[0]]
+    # Items are copied before they are merged, so the input is left untouched
+    concatenated = [dict(transcripts[0])]
     max_duration = 2 * 60  # 2 minutes
 
     for current in transcripts[1:]:
@@ -82,18 +108,14 @@ def concat_close_transcripts(transcripts, threshold=2.0):
             diff <= threshold * threshold_factor
             and (current["end"] - previous["start"]) <= max_duration
         ):
-            diff_seconds = max(0, diff // 1)  # Round down to nearest second
+            # Round down to nearest second
+            pause = _PAUSE_TMPL.format(seconds=max(0, int(diff)))
             # Concatenate texts
             previous["end"] = current["end"]
-            previous["text"] += (
-                f"\n (pause for {diff_seconds} seconds). \n" + current["text"]
-            )
-            previous["translated_text"] += (
-                f"\n (pause for {diff_seconds} seconds). \n"
-                + current["translated_text"]
-            )
+            previous["text"] += pause + current["text"]
+            previous["translated_text"] += pause + current["translated_text"]
         else:
-            concatenated.append(current)
+            concatenated.append(dict(current))
 
     return concatenated
 
@@ -105,10 +127,6 @@ def yt_download(
     target_language: str,
 ) -> tuple[str, str, list[str]]:
     downloader = VideoDownloader(youtube_id=youtube_id, output_dir=output_directory)
-    video_path = downloader.download_video()
-    print(f"Video downloaded to {video_path}")
-    audio_path = downloader.download_audio()
-    print(f"Audio downloaded to {audio_path}")
 
     subtitle_paths = []
     source_file = os.path.join(output_directory, "subtitles", f"{source_language}.json")
@@ -118,64 +136,444 @@ def yt_download(
         subtitle_paths.append(source_file)
     if os.path.exists(target_file):
         subtitle_paths.append(target_file)
-    if not subtitle_paths:
-        subtitle_paths = downloader.download_subtitles(
-            language_codes=[source_language, target_language]
-        )
-        print(f"Subtitles downloaded to {subtitle_paths}")
+
+    # The video, audio and subtitles are separate requests, so they are
+    # downloaded concurrently
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        video_future = executor.submit(downloader.download_video)
+        audio_future = executor.submit(downloader.download_audio)
+        subtitles_future = None
+        if not subtitle_paths:
+            subtitles_future = executor.submit(
+                downloader.download_subtitles,
+                language_codes=[source_language, target_language],
+            )
+
+        video_path = video_future.result()
+        print(f"Video downloaded to {video_path}")
+        audio_path = audio_future.result()
+        print(f"Audio downloaded to {audio_path}")
+        if subtitles_future:
+            subtitle_paths = subtitles_future.result()
+            print(f"Subtitles downloaded to {subtitle_paths}")
     return video_path, audio_path, subtitle_paths
 
 
-def transcribe_using_ytt(youtube_id, source_language, target_language, api_keys):
-    transcripts = []
+def fetch_ytt_transcript(
+    youtube_id, source_language, target_language, output_directory=None
+):
+    """Fetches the YouTube transcript, preferring the target language.
+
+    The transcript is cached in output_directory, so re-runs skip the API.
 
+    Returns:
+        A tuple of the transcript and the language it was fetched in.
+    """
+    ytt = YoutubeToText(youtube_id=youtube_id, output_dir=output_directory)
     try:
-        ytt = YoutubeToText(youtube_id=youtube_id)
         # First check if the transcript is available in the target language
-        _transcript = ytt.get_transcript(language_codes=[target_language])
-        transcripts = [
+        return ytt.get_transcript(language_codes=[target_language]), target_language
+    except Exception as e:
+        print(f"Error fetching transcript in {target_language}: {e}")
+        # Fallback to source language
+        return ytt.get_transcript(language_codes=[source_language]), source_language
+
+
+def transcribe_using_ytt(
+    youtube_id,
+    source_language,
+    target_language,
+    api_keys,
+    fetched=None,
+    output_directory=None,
+):
+    """Builds the transcripts from the YouTube transcript, translating if needed.
+
+    fetched is the result of a fetch_ytt_transcript call made ahead of time,
+    if any.
+    """
+    _transcript, language = fetched or fetch_ytt_transcript(
+        youtube_id, source_language, target_language, output_directory
+    )
+    if language == target_language:
+        return [
             {
-                "start": item["start"],
-                "end": item["end"],
-                "text": item["text"],
-                "translated_text": item["text"],
+                "start": item.start,
+                "end": item.end,
+                "text": item.text,
+                "translated_text": item.text,
             }
             for item in _transcript
         ]
-    except Exception as e:
-        print(f"Error fetching transcript in {target_language}: {e}")
-        # Fallback to source language
-        _transcript = ytt.get_transcript(language_codes=[source_language])
-        transcripts = translate_transcripts(
-            _transcript, source_language, target_language, api_keys
-        )
-        print("Transcript fetched:")
+
+    transcripts = translate_transcripts(
+        _transcript, source_language, target_language, api_keys
+    )
+    print("Transcript fetched:")
     return transcripts
 
 
+def _segment_output_path(output_directory, item, i):
+    return os.path.join(
+        output_directory,
+        SEGMENTS_DIRECTORY,
+        f"segment_{i+1}_{item['start']//1}_{item['end']//1}.wav",
+    )
+
+
+def _retry_after(error):
+    """Returns the delay in seconds the server asked to wait before retrying, if any."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers["retry-after"])
+    except (KeyError, ValueError):
+        pass
+    details = error.details if isinstance(error.details, dict) else {}
+    for detail in details.get("error", details).get("details", []):
+        retry_delay = detail.get("retryDelay", "")
+        if retry_delay.endswith("s"):
+            try:
+                return float(retry_delay[:-1])
+            except ValueError:
+                pass
+    return None
+
+
+def _convert_text_to_speech(scheduler, tts_clients, **kwargs):
+    """Synthesizes speech with the least loaded API key.
+
+    A key that fails with a client error (usually a rate limit) is put on
+    cooldown by the scheduler and the request is retried with another key, up
+    to _MAX_TTS_ATTEMPTS times. The second half of the attempts go to the backup
+    model, which has its own quota. Responses without audio are retried too;
+    invalid requests are not.
+
+    Returns:
+        The TextToSpeechGemini instance that synthesized the audio.
+    """
+    for attempt in range(_MAX_TTS_ATTEMPTS):
+        api_key = scheduler.acquire()
+        tts = tts_clients[api_key]
+        try:
+            tts._convert_text_to_speech(
+                **kwargs, backup=attempt >= _MAX_TTS_ATTEMPTS // 2
+            )
+        except errors.ClientError as e:
+            if e.code == 400 or attempt == _MAX_TTS_ATTEMPTS - 1:
+                scheduler.release(api_key)
+                raise
+            scheduler.release(api_key, ok=False, retry_after=_retry_after(e))
+            continue
+        except NoAudioError:
+            # An empty response is not the key's fault, so it stays available
+            scheduler.release(api_key)
+            if attempt == _MAX_TTS_ATTEMPTS - 1:
+                raise
+            continue
+        except Exception:
+            scheduler.release(api_key)
+            raise
+        scheduler.release(api_key)
+        return tts
+
+
 def synthesize_speech_worker(
-    item, i, total, output_directory, voice, target_language, api_key
+    item, i, total, output_directory, voice, target_language, scheduler, tts_clients
 ):
-    """Worker function to synthesize speech for a single transcript item."""
-    tts = TextToSpeechGemini(api_key=api_key)
+    """Worker function to synthesize speech for a single transcript item.
+
+    tts_clients maps each API key to its TextToSpeechGemini instance, shared
+    between workers so requests reuse the client's open connections. The API
+    key is only held for the duration of the Gemini call; the silence trimming
+    that follows runs after it is released to the scheduler.
+    """
     print(f"Synthesizing speech for segment {i+1}/{total}")
-    output_path = (
-        f"{output_directory}/segment_{i+1}_{item['start']//1}_{item['end']//1}.wav"
+    output_path = _segment_output_path(output_directory, item, i)
+    text = item["translated_text"] or item["text"]
+    cache = TTSCache(output_directory)
+    cache_key = TTSCache.key(
+        voice=voice, target_language=target_language, speed=1.0, text=text
     )
-    if os.path.exists(output_path):
+    if os.path.exists(output_path) or cache.restore(cache_key, output_path):
         print(f"Audio already exists for segment {i+1}, skipping synthesis.")
         item["dubbed_path"] = output_path
         item["for_dubbing"] = True
         return item
 
-    _audio_data = tts._convert_text_to_speech_without_end_silence(
+    tts = _convert_text_to_speech(
+        scheduler,
+        tts_clients,
         assigned_voice=voice,
         target_language=target_language,
         output_filename=output_path,
-        text=item["translated_text"] or item["text"],
+        text=text,
         speed=1.0,
     )
+    _audio_data = tts._remove_end_silence(output_path)
+    cache.put(cache_key, output_path)
     item["dubbed_path"] = output_path
     item["for_dubbing"] = True
     print(f"Saved synthesized speech to {output_path} {_audio_data}")
     return item
+
+
+def batch_transcripts_for_tts(transcripts, max_chars=1500, max_gap=20.0, max_items=4):
+    """Groups consecutive transcript items so they can share a single TTS request.
+
+    Items are packed while the combined text stays under max_chars, the gap
+    between two items is at most max_gap seconds and the batch holds at most
+    max_items items, since every extra pause is another chance to split wrong.
+
+    Returns:
+        A list of batches, each a list of indices into transcripts.
+    """
+    batches = []
+    batch_chars = 0
+    for i, item in enumerate(transcripts):
+        text = item["translated_text"] or item["text"]
+        if (
+            batches
+            and len(batches[-1]) < max_items
+            and batch_chars + len(_TTS_BATCH_PAUSE) + len(text) <= max_chars
+            and item["start"] - transcripts[batches[-1][-1]]["end"] <= max_gap
+        ):
+            batches[-1].append(i)
+            batch_chars += len(_TTS_BATCH_PAUSE) + len(text)
+        else:
+            batches.append([i])
+            batch_chars = len(text)
+    return batches
+
+
+def _detect_silence(samples, frame_rate, channels, min_silence_len, silence_thresh):
+    """Finds the silent ranges of PCM audio, like pydub.silence.detect_silence.
+
+    Args:
+        samples: The interleaved samples, as a numpy array.
+        frame_rate: Frames per second.
+        channels: Number of interleaved channels.
+        min_silence_len: Minimum length in ms of a silent range.
+        silence_thresh: RMS level in dBFS under which audio is silent.
+
+    Returns:
+        A list of [start, end] ranges in ms.
+    """
+    duration = len(samples) * 1000 // (frame_rate * channels)
+    if duration < min_silence_len:
+        return []
+    max_amplitude = float(np.iinfo(samples.dtype).max + 1)
+    thresh = 10 ** (silence_thresh / 20) * max_amplitude
+
+    # Sum of squares up to each ms boundary, so every window's RMS is O(1)
+    bounds = np.arange(duration + 1) * frame_rate // 1000 * channels
+    energy = np.concatenate(([0.0], np.cumsum(samples.astype(np.float64) ** 2)))
+    window_energy = energy[bounds[min_silence_len:]] - energy[bounds[:-min_silence_len]]
+    window_samples = bounds[min_silence_len:] - bounds[:-min_silence_len]
+    silent = np.sqrt(window_energy / window_samples) <= thresh
+
+    ranges = []
+    for start in np.flatnonzero(silent):
+        start = int(start)
+        # Windows starting within the previous range extend it, as in pydub
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1][1] = start + min_silence_len
+        else:
+            ranges.append([start, start + min_silence_len])
+    return ranges
+
+
+def split_batch_wav(wav_path, breakpoints, output_paths, min_silence_len=700):
+    """Cuts a batched TTS file back into one file per transcript item.
+
+    Args:
+        wav_path: The audio synthesized for the whole batch.
+        breakpoints: The approximate position of each boundary between items,
+            as a fraction of the batch text length.
+        output_paths: The files to write, one per item.
+        min_silence_len: Minimum length in ms of the pauses to split on.
+
+    Returns:
+        True if the file was split, False if not enough pauses were found to
+        place every breakpoint.
+    """
+    with wave.open(wav_path, "rb") as f:
+        params = f.getparams()
+        frames = f.readframes(params.nframes)
+    frame_size = params.sampwidth * params.nchannels
+    samples = np.frombuffer(frames, dtype=f"<i{params.sampwidth}")
+    duration = params.nframes * 1000 / params.framerate
+    silences = _detect_silence(
+        samples,
+        params.framerate,
+        params.nchannels,
+        min_silence_len=min_silence_len,
+        silence_thresh=-40,
+    )
+
+    cuts = []
+    for k, breakpoint in enumerate(breakpoints):
+        # Leave enough pauses after this one for the remaining breakpoints
+        candidates = silences[: len(silences) - (len(breakpoints) - k - 1)]
+        if not candidates:
+            return False
+        expected = breakpoint * duration
+        nearest = min(candidates, key=lambda s: abs((s[0] + s[1]) / 2 - expected))
+        if abs((nearest[0] + nearest[1]) / 2 - expected) > duration / 4:
+            return False
+        cuts.append(nearest)
+        silences = silences[silences.index(nearest) + 1 :]
+
+    # Every piece lies between two consecutive cuts, so cuts that overlap or
+    # touch would leave an empty segment behind
+    end = params.nframes * 1000 // params.framerate
+    starts = [0] + [silence_end for _, silence_end in cuts]
+    ends = [silence_start for silence_start, _ in cuts] + [end]
+    if any(piece_end <= piece_start for piece_start, piece_end in zip(starts, ends)):
+        return False
+
+    def write(output_path, start_ms, end_ms):
+        start = start_ms * params.framerate // 1000 * frame_size
+        end = end_ms * params.framerate // 1000 * frame_size
+        with wave.open(output_path, "wb") as f:
+            f.setparams(params)
+            f.writeframes(frames[start:end])
+
+    for output_path, piece_start, piece_end in zip(output_paths, starts, ends):
+        write(output_path, piece_start, piece_end)
+    return True
+
+
+def synthesize_speech_batch_worker(
+    transcripts,
+    indices,
+    output_directory,
+    voice,
+    target_language,
+    scheduler,
+    tts_clients,
+):
+    """Worker function to synthesize speech for a batch of transcript items.
+
+    The texts are joined with a pause and synthesized with a single request,
+    then the audio is split back on the pauses. Falls back to one request per
+    item if the audio cannot be split.
+
+    Returns:
+        The updated transcript items of the batch, with None for the items
+        that failed.
+    """
+    total = len(transcripts)
+    cache = TTSCache(output_directory)
+    missing = []
+    for i in indices:
+        path = _segment_output_path(output_directory, transcripts[i], i)
+        text = transcripts[i]["translated_text"] or transcripts[i]["text"]
+        cache_key = TTSCache.key(
+            voice=voice, target_language=target_language, speed=1.0, text=text
+        )
+        if not os.path.exists(path) and not cache.restore(cache_key, path):
+            missing.append((i, path, text, cache_key))
+    if len(missing) > 1:
+        texts = [text for _, _, text, _ in missing]
+        batch_text = _TTS_BATCH_PAUSE.join(texts)
+        breakpoints = []
+        position = 0
+        for text in texts[:-1]:
+            position += len(text) + len(_TTS_BATCH_PAUSE) / 2
+            breakpoints.append(position / len(batch_text))
+            position += len(_TTS_BATCH_PAUSE) / 2
+
+        first, last = missing[0][0], missing[-1][0]
+        print(f"Synthesizing speech for segments {first+1}-{last+1}/{total}")
+        batch_path = os.path.join(
+            output_directory, SEGMENTS_DIRECTORY, f"batch_{first+1}_{last+1}.wav"
+        )
+        split = False
+        try:
+            tts = _convert_text_to_speech(
+                scheduler,
+                tts_clients,
+                assigned_voice=voice,
+                target_language=target_language,
+                output_filename=batch_path,
+                text=batch_text,
+                speed=1.0,
+            )
+            split = split_batch_wav(
+                batch_path, breakpoints, [path for _, path, _, _ in missing]
+            )
+            if split:
+                for _, path, _, cache_key in missing:
+                    tts._remove_end_silence(path)
+                    cache.put(cache_key, path)
+        except Exception as e:
+            print(f"Error synthesizing segments {first+1}-{last+1}: {e}")
+            split = False
+            # Pieces left by a failed split would be taken as already synthesized
+            for _, path, _, _ in missing:
+                if os.path.exists(path):
+                    os.remove(path)
+        finally:
+            if os.path.exists(batch_path):
+                os.remove(batch_path)
+        if not split:
+            print(
+                f"Unable to split segments {first+1}-{last+1}, synthesizing them one by one."
+            )
+
+    # A failing segment only loses itself, not the rest of its batch
+    results = []
+    for i in indices:
+        try:
+            results.append(
+                synthesize_speech_worker(
+                    transcripts[i],
+                    i,
+                    total,
+                    output_directory,
+                    voice,
+                    target_language,
+                    scheduler,
+                    tts_clients,
+                )
+            )
+        except Exception as e:
+            print(f"Error synthesizing segment {i+1}/{total}: {e}")
+            results.append(None)
+    return results
+
+
+def load_tts_progress(progress_file, transcripts):
+    """Reads the segments synthesized by a previous, interrupted run.
+
+    Returns:
+        A dict mapping transcript indices to their updated items, limited to
+        entries that still match the transcript and whose audio still exists.
+    """
+    completed = {}
+    if not os.path.exists(progress_file):
+        return completed
+    with open(progress_file, "rb") as f:
+        for line in f:
+            try:
+                item = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # Last line cut short by a crash
+                continue
+            i = item.pop("index")
+            if (
+                i < len(transcripts)
+                and transcripts[i]["start"] == item["start"]
+                and os.path.exists(item["dubbed_path"])
+            ):
+                completed[i] = item
+    return completed
+
+
+def append_tts_progress(progress_file, entries):
+    """Appends (index, item) pairs of synthesized segments to the progress file."""
+    with open(progress_file, "ab") as f:
+        for i, item in entries:
+            f.write(orjson.dumps({"index": i, **item}) + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
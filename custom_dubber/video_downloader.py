@@ -1,21 +1,61 @@
-from pathlib import Path
+import concurrent.futures
+import copy
+import orjson
+import shutil
+import threading
+import urllib.request
 import yt_dlp
 import os
 
+_SUBTITLE_TIMEOUT_SECONDS = 30
+# Fragments are fetched in parallel, but few enough not to trip YouTube's
+# anti-bot checks; larger HTTP chunks mean fewer requests per file
+_THROUGHPUT_OPTS = {
+    "concurrent_fragment_downloads": 4,
+    "http_chunk_size": 10 * 1024 * 1024,
+}
+
 
 class VideoDownloader:
     def __init__(self, youtube_id, output_dir=None):
         self.youtube_id = youtube_id
         self.output_path = output_dir or os.path.join("__output", self.youtube_id)
+        self.url = f"https://www.youtube.com/watch?v={self.youtube_id}"
+        # Created once here so the download methods can write straight away
+        os.makedirs(os.path.join(self.output_path, "subtitles"), exist_ok=True)
+        self._info = None
+        self._info_lock = threading.Lock()
+
+    def _get_info(self):
+        """Returns the video info, extracted from YouTube once per downloader."""
+        with self._info_lock:
+            if self._info is None:
+                with yt_dlp.YoutubeDL({"quiet": True}) as ydl:
+                    self._info = ydl.extract_info(
+                        self.url, download=False, process=False
+                    )
+        return self._info
+
+    def _download(self, ydl_opts):
+        """Downloads with the given options, reusing the extracted video info."""
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            # Processing mutates the info, so every download gets its own copy
+            ydl.process_ie_result(copy.deepcopy(self._get_info()), download=True)
 
     def download_audio(self):
         audio_path = os.path.join(self.output_path, "audio")
+        # FFmpegExtractAudio adds the extension to the output template
+        audio_file = audio_path + ".mp3"
+        if os.path.exists(audio_file):
+            print(f"Audio already downloaded at {audio_file}")
+            return audio_file
 
         ydl_audio_opts = {
             "format": "bestaudio/best",
             "outtmpl": audio_path,
             "quiet": True,
             "keepvideo": False,
+            **_THROUGHPUT_OPTS,
             "postprocessors": [
                 {
                     "key": "FFmpegExtractAudio",
@@ -24,18 +64,20 @@ class VideoDownloader:
                 }
             ],
         }
-        with yt_dlp.YoutubeDL(ydl_audio_opts) as ydl:
-            ydl.download([f"https://www.youtube.com/watch?v={self.youtube_id}"])
-
-        return os.path.join(self.output_path, Path(audio_path).name + ".mp3")
+        if shutil.which("aria2c"):
+            # Single-stream audio downloads benefit from aria2c's split connections
+            ydl_audio_opts["external_downloader"] = {"default": "aria2c"}
+            ydl_audio_opts["external_downloader_args"] = {
+                "aria2c": ["-x", "4", "-k", "1M"]
+            }
+        self._download(ydl_audio_opts)
+        return audio_file
 
     def download_video(self):
         video_path = os.path.join(self.output_path, "video.mp4")
         if os.path.exists(video_path):
             print(f"Video already downloaded at {video_path}")
         else:
-            os.makedirs(self.output_path, exist_ok=True)
-
             ydl_opts = {
                 "format": "bestvideo[height=1080][ext=mp4]/best",
                 "outtmpl": video_path,
@@ -44,6 +86,7 @@ class VideoDownloader:
                 "embedthumbnail": True,
                 "embedsubtitles": True,
                 "keepvideo": True,
+                **_THROUGHPUT_OPTS,
                 "postprocessors": [
                     {
                         "key": "FFmpegVideoConvertor",
@@ -51,54 +94,88 @@ class VideoDownloader:
                     }
                 ],
             }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([f"https://www.youtube.com/watch?v={self.youtube_id}"])
-        return os.path.join(self.output_path, Path(video_path).stem + ".mp4")
+            self._download(ydl_opts)
+        return video_path
 
     def download_subtitles(self, language_codes):
-        paths = []
-
         try:
-            # fetch available subtitles info first including generated ones
-            ydl_opts = {
-                "skip_download": True,
-                "writesubtitles": True,
-                "writeautomaticsub": True,
-                "subtitlesformat": "json3",
-                "subtitleslangs": language_codes,
-                "quiet": True,
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info_dict = ydl.extract_info(
-                    f"https://www.youtube.com/watch?v={self.youtube_id}", download=False
-                )
-                available_subs = info_dict.get("subtitles", {})
-                print(f"Available subtitles: {available_subs}")
+            # fetch available subtitles info first
+            available_subs = self._get_info().get("subtitles") or {}
+            print(f"Available subtitles: {list(available_subs)}")
         except Exception as e:
             print(f"Error fetching available subtitles: {e}")
-            available_subs = {}
+            available_subs = None
 
-        for lang in language_codes:
-            subtitle_path = os.path.join(self.output_path, "subtitles", f"{lang}.json")
-            if os.path.exists(subtitle_path):
-                print(f"Subtitles for {lang} already downloaded at {subtitle_path}")
-                continue
+        # Languages are fetched in parallel; map keeps the paths in language order
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, min(4, len(language_codes)))
+        ) as executor:
+            paths = executor.map(
+                self._download_subtitle,
+                language_codes,
+                [
+                    None if available_subs is None else available_subs.get(lang, [])
+                    for lang in language_codes
+                ],
+            )
+        return [path for path in paths if path]
 
-            ydl_opts = {
-                "writesubtitles": True,
-                "subtitleslangs": [lang],
-                "subtitlesformat": "json3",
-                "skip_download": True,
-                "outtmpl": subtitle_path,
-                "quiet": True,
-            }
+    def _download_subtitle(self, lang, formats=None):
+        """Downloads the subtitles for one language, returning the path or None.
+
+        Args:
+            lang: The language code.
+            formats: The subtitle formats the probe listed for lang, or None if
+                the probe failed.
+        """
+        subtitle_path = os.path.join(self.output_path, "subtitles", f"{lang}.json")
+        if os.path.exists(subtitle_path):
+            print(f"Subtitles for {lang} already downloaded at {subtitle_path}")
+            return None
+        if formats is not None and not formats:
+            print(f"No subtitles available for {lang}")
+            return None
+
+        # The probe already resolved the json3 URL, so fetch it directly
+        url = next((f["url"] for f in formats or [] if f.get("ext") == "json3"), None)
+        if url:
             try:
                 print(f"Downloading subtitles for {lang}...")
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([f"https://www.youtube.com/watch?v={self.youtube_id}"])
-                paths.append(subtitle_path)
+                with urllib.request.urlopen(
+                    url, timeout=_SUBTITLE_TIMEOUT_SECONDS
+                ) as response:
+                    data = response.read()
+                # A truncated or error body would be reused by every later run
+                if "events" not in orjson.loads(data):
+                    raise ValueError("response has no subtitle events")
+                # utils imports this module, so its helper is imported here
+                from .utils import atomic_write_bytes
 
+                atomic_write_bytes(subtitle_path, data)
+                return subtitle_path
             except Exception as e:
-                print(f"Error downloading subtitles for {lang}: {e}")
+                print(f"Error fetching subtitles for {lang} directly: {e}")
 
-        return paths
+        # yt-dlp names subtitle files <outtmpl without extension>.<lang>.<format>
+        ytdlp_base = os.path.join(self.output_path, "subtitles", f"{lang}_ytdlp")
+        ytdlp_path = f"{ytdlp_base}.{lang}.json3"
+        ydl_opts = {
+            "writesubtitles": True,
+            "subtitleslangs": [lang],
+            "subtitlesformat": "json3",
+            "skip_download": True,
+            "outtmpl": ytdlp_base + ".%(ext)s",
+            "quiet": True,
+        }
+        try:
+            print(f"Downloading subtitles for {lang}...")
+            self._download(ydl_opts)
+            # yt-dlp writes nothing if the language isn't offered
+            if not os.path.exists(ytdlp_path):
+                return None
+            os.replace(ytdlp_path, subtitle_path)
+            return subtitle_path
+
+        except Exception as e:
+            print(f"Error downloading subtitles for {lang}: {e}")
+            return None
@@ -15,39 +15,113 @@
 import os
 import subprocess
 import time
-import warnings
 
 from typing import Final
 
-from moviepy import (
-    AudioFileClip,
-    VideoFileClip,
-)
+from .ffmpeg import FFmpeg
 
-_DEFAULT_FPS: Final[int] = 30
 _DEFAULT_DUBBED_VIDEO_FILE: Final[str] = "dubbed_video"
 _DEFAULT_OUTPUT_FORMAT: Final[str] = ".mp4"
+# Audio codecs that are copied into the dubbed MP4 as they are, so its audio is
+# always AAC
+_MP4_AUDIO_CODECS: Final[frozenset[str]] = frozenset({"aac"})
+# Extensions of the audio-only files codecs are copied into when demuxing
+_AUDIO_COPY_EXTENSIONS: Final[dict[str, str]] = {"aac": ".m4a", "mp3": ".mp3"}
+
+
+def _probe_audio(path: str) -> tuple[str, float]:
+    """Returns the codec of the first audio stream of a file and its duration."""
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "a:0",
+            "-show_entries",
+            "stream=codec_name:format=duration",
+            "-of",
+            "default=nw=1",
+            path,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    entries = dict(line.split("=", 1) for line in result.stdout.splitlines())
+    return entries["codec_name"], float(entries["duration"])
+
+
+def _probe_duration(path: str) -> float:
+    """Returns the duration in seconds of a media file, read from its container."""
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "default=nw=1:nk=1",
+            path,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(result.stdout.strip())
 
 
 class VideoProcessing:
     @staticmethod
     def split_audio_video(*, video_file: str, output_directory: str) -> tuple[str, str]:
-        """Splits an audio/video file into separate audio and video files."""
+        """Splits an audio/video file into separate audio and video files.
+
+        Returns:
+          The video file and the audio file, whose extension depends on the
+          source audio codec.
+        """
 
         base_filename = os.path.basename(video_file)
         filename, _ = os.path.splitext(base_filename)
-        with VideoFileClip(video_file) as video_clip, warnings.catch_warnings():
-            warnings.filterwarnings("ignore", category=UserWarning)
-            audio_clip = video_clip.audio
-            audio_output_file = os.path.join(output_directory, filename + "_audio.mp3")
-            audio_clip.write_audiofile(audio_output_file, logger=None)
-            video_clip_without_audio = video_clip.with_audio(None)
-            fps = video_clip.fps or _DEFAULT_FPS
-
-            video_output_file = os.path.join(output_directory, filename + "_video.mp4")
-            video_clip_without_audio.write_videofile(
-                video_output_file, codec="libx264", fps=fps, logger=None
-            )
+        video_output_file = os.path.join(output_directory, filename + "_video.mp4")
+
+        # AAC and MP3 audio is copied as is, anything else is encoded to MP3
+        audio_codec, _ = _probe_audio(video_file)
+        if audio_codec in _AUDIO_COPY_EXTENSIONS:
+            audio_extension = _AUDIO_COPY_EXTENSIONS[audio_codec]
+            audio_args = ["-c:a", "copy"]
+        else:
+            audio_extension = ".mp3"
+            audio_args = ["-c:a", "libmp3lame", "-q:a", "2"]
+        audio_output_file = os.path.join(
+            output_directory, filename + "_audio" + audio_extension
+        )
+
+        # One ffmpeg pass demuxes both outputs, copying the video stream
+        FFmpeg()._run(
+            command=[
+                "ffmpeg",
+                "-hide_banner",
+                "-nostats",
+                "-loglevel",
+                "warning",
+                "-y",
+                "-i",
+                video_file,
+                "-map",
+                "0:v:0",
+                "-c:v",
+                "copy",
+                "-an",
+                video_output_file,
+                "-map",
+                "0:a:0",
+                "-vn",
+                *audio_args,
+                audio_output_file,
+            ]
+        )
         return video_output_file, audio_output_file
 
     @staticmethod
@@ -57,21 +131,37 @@ class VideoProcessing:
         dubbed_audio_file: str,
         output_directory: str,
         target_language: str,
+        reencode: bool = False,
     ) -> str:
         """Combines an audio file with a video file, ensuring they have the same duration.
 
+        Args:
+          reencode: Re-encode the video with libx264 instead of copying its stream.
+
         Returns:
           The path to the output video file with dubbed audio.
         """
         print("Combining audio and video...")
 
-        # Get video and audio durations using MoviePy
-        video = VideoFileClip(video_file)
-        audio = AudioFileClip(dubbed_audio_file)
-        video_duration = video.duration
-        audio_duration = audio.duration
-        video.close()
-        audio.close()
+        # Durations and codecs are read from the container headers
+        video_duration = _probe_duration(video_file)
+        audio_codec, audio_duration = _probe_audio(dubbed_audio_file)
+        if audio_codec in _MP4_AUDIO_CODECS and audio_duration >= video_duration:
+            # Nothing to pad, so the audio stream is copied without re-encoding
+            audio_args = ["-map", "1:a:0", "-c:a", "copy"]
+        else:
+            # Pad the audio with silence if it is shorter than the video; apad
+            # passes longer audio through unchanged
+            audio_args = [
+                "-filter_complex",
+                f"[1:a]apad=whole_dur={video_duration}[aout]",
+                "-map",
+                "[aout]",  # Map padded audio from second input
+                "-c:a",
+                "aac",  # Encode audio to AAC
+                "-b:a",
+                "192k",  # Audio bitrate
+            ]
 
         target_language_suffix = "_" + target_language.replace("-", "_").lower()
         dubbed_video_file = os.path.join(
@@ -88,6 +178,10 @@ class VideoProcessing:
         # This avoids re-encoding the video, making it 10-100x faster
         ffmpeg_cmd = [
             "ffmpeg",
+            "-hide_banner",
+            "-nostats",
+            "-loglevel",
+            "warning",
             "-y",  # Overwrite output file without asking
             "-i",
             video_file,  # Input video
@@ -95,14 +189,12 @@ class VideoProcessing:
             dubbed_audio_file,  # Input audio
             "-map",
             "0:v:0",  # Map video stream from first input
-            "-map",
-            "1:a:0",  # Map audio stream from second input
-            "-c:v",
-            "copy",  # Copy video codec (no re-encoding)
-            "-c:a",
-            "aac",  # Encode audio to AAC
-            "-b:a",
-            "192k",  # Audio bitrate
+            *(
+                ["-c:v", "libx264", "-preset", "veryfast"]
+                if reencode
+                else ["-c:v", "copy"]  # Copy video codec (no re-encoding)
+            ),
+            *audio_args,
             "-shortest",  # Finish encoding when shortest stream ends
             "-movflags",
             "+faststart",  # Enable streaming optimization (moov atom at start)
@@ -111,61 +203,8 @@ class VideoProcessing:
             dubbed_video_file,
         ]
 
-        # If audio is shorter than video, we need to pad it with silence
-        if audio_duration < video_duration:
-            print(
-                f"Audio is {video_duration - audio_duration:.2f}s shorter than video, padding with silence..."
-            )
-            # Create a temporary audio file with silence padding
-            temp_audio = os.path.join(output_directory, "temp_padded_audio.aac")
-            pad_duration = video_duration - audio_duration
-
-            # Use FFmpeg to pad audio with silence
-            pad_cmd = [
-                "ffmpeg",
-                "-y",
-                "-i",
-                dubbed_audio_file,
-                "-f",
-                "lavfi",
-                "-i",
-                f"anullsrc=channel_layout=stereo:sample_rate=44100:duration={pad_duration}",
-                "-filter_complex",
-                "[0:a][1:a]concat=n=2:v=0:a=1",
-                "-c:a",
-                "aac",
-                "-b:a",
-                "192k",
-                temp_audio,
-            ]
-            subprocess.run(
-                pad_cmd,
-                check=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
-
-            # Update the command to use padded audio
-            ffmpeg_cmd[4] = temp_audio
-
-        # Run FFmpeg command
-        try:
-            subprocess.run(
-                ffmpeg_cmd,
-                check=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
-
-            # Clean up temporary file if created
-            if audio_duration < video_duration:
-                temp_audio = os.path.join(output_directory, "temp_padded_audio.aac")
-                if os.path.exists(temp_audio):
-                    os.remove(temp_audio)
-
-        except subprocess.CalledProcessError as e:
-            print(f"Error during video rendering: {e}")
-            raise
+        # Run FFmpeg command; on failure _run logs its stderr and raises
+        FFmpeg()._run(command=ffmpeg_cmd)
 
         end_time = time.time()
         print(
@@ -1,24 +1,50 @@
+import orjson
+import os
 import re
+from typing import NamedTuple
 from youtube_transcript_api import YouTubeTranscriptApi
 
+_BRACKET_RE = re.compile(r"\[[^\]]*\]|\([^)]*\)")
+
+
+class Cue(NamedTuple):
+    start: float
+    end: float
+    text: str
+
 
 class YoutubeToText:
-    def __init__(self, youtube_id):
+    def __init__(self, youtube_id, output_dir=None):
         self.youtube_id = youtube_id
+        self.output_path = output_dir or os.path.join("__output", self.youtube_id)
         self.api = YouTubeTranscriptApi()
         self.transcript = None
 
+    def iter_transcript(self, language_codes):
+        """Yields the transcript items one by one as they are filtered."""
+        for item in self.api.fetch(self.youtube_id, languages=language_codes):
+            # Skip items that only hold text within square brackets and parentheses
+            if _BRACKET_RE.sub("", item.text).strip():
+                yield Cue(item.start, item.start + item.duration, item.text)
+
     def get_transcript(self, language_codes):
-        def filter_bracket_text(text):
-            # Remove text within square brackets and parentheses
-            text = re.sub(r"\[.*?\]", "", text)
-            text = re.sub(r"\(.*?\)", "", text)
-            return text.strip()
-
-        transcript_list = self.api.fetch(self.youtube_id, languages=language_codes)
-        self.transcript = [
-            {"start": item.start, "end": item.start + item.duration, "text": item.text}
-            for item in transcript_list
-            if filter_bracket_text(item.text) != ""
-        ]
+        """Returns the filtered transcript, cached per video and language codes."""
+        cache_path = os.path.join(
+            self.output_path,
+            f"transcript_{self.youtube_id}_{'_'.join(language_codes)}.json",
+        )
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                self.transcript = [Cue(*item) for item in orjson.loads(f.read())]
+            return self.transcript
+
+        self.transcript = list(self.iter_transcript(language_codes))
+
+        # utils imports this module, so its helper is imported at call time
+        from .utils import atomic_write_bytes
+
+        os.makedirs(self.output_path, exist_ok=True)
+        atomic_write_bytes(
+            cache_path, orjson.dumps([tuple(cue) for cue in self.transcript])
+        )
         return self.transcript
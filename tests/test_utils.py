@@ -0,0 +1,86 @@
+import wave
+
+import numpy as np
+import pytest
+
+from custom_dubber.utils import _detect_silence, split_batch_wav
+
+silence = pytest.importorskip("pydub.silence")
+AudioSegment = pytest.importorskip("pydub").AudioSegment
+
+FRAME_RATE = 16000
+
+
+def _tone(ms, amplitude=8000):
+    t = np.arange(ms * FRAME_RATE // 1000) / FRAME_RATE
+    return (amplitude * np.sin(2 * np.pi * 440 * t)).astype("<i2")
+
+
+def _silence(ms):
+    return np.zeros(ms * FRAME_RATE // 1000, dtype="<i2")
+
+
+@pytest.fixture
+def speech():
+    """Speech-like PCM with pauses, the first one holding two faint clicks.
+
+    Each click alone stays under the silence threshold of a 700 ms window, but
+    both together do not, so the silent windows around them overlap without
+    being contiguous.
+    """
+    return np.concatenate(
+        [
+            _tone(2000),
+            _silence(500),
+            _tone(5, amplitude=4700),
+            _silence(295),
+            _tone(5, amplitude=4700),
+            _silence(1200),
+            _tone(1500),
+            _silence(1200),
+            _tone(800),
+        ]
+    )
+
+
+@pytest.mark.parametrize("channels", [1, 2])
+@pytest.mark.parametrize("min_silence_len", [300, 700])
+def test_detect_silence_matches_pydub(speech, channels, min_silence_len):
+    samples = np.repeat(speech, channels)
+    segment = AudioSegment(
+        data=samples.tobytes(),
+        sample_width=2,
+        frame_rate=FRAME_RATE,
+        channels=channels,
+    )
+
+    expected = silence.detect_silence(
+        segment, min_silence_len=min_silence_len, silence_thresh=-40
+    )
+
+    assert (
+        _detect_silence(
+            samples,
+            FRAME_RATE,
+            channels,
+            min_silence_len=min_silence_len,
+            silence_thresh=-40,
+        )
+        == expected
+    )
+
+
+def test_split_batch_wav_writes_non_empty_pieces(speech, tmp_path):
+    wav_path = tmp_path / "batch.wav"
+    with wave.open(str(wav_path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(FRAME_RATE)
+        f.writeframes(speech.tobytes())
+    output_paths = [str(tmp_path / f"segment_{i}.wav") for i in range(3)]
+
+    assert split_batch_wav(str(wav_path), [0.4, 0.8], output_paths)
+
+    for output_path in output_paths:
+        with wave.open(output_path, "rb") as f:
+            assert f.getnframes() > 0